@@ -1,72 +1,227 @@
 import os
-import subprocess
+import re
+import string
+import datetime
+import functools
+import logging
+import tempfile
+import time
 from getpass import getpass
 from dotenv import load_dotenv
 import argparse
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from cryptography import x509
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+from cryptography.hazmat.backends.openssl import backend as openssl_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
 
-# Load environment variables from .env file
-load_dotenv()
+log = logging.getLogger(__name__)
 
-# Read environment variables
-CA_KEY = os.getenv("CA_KEY", "./ca.key")
-CA_CERT = os.getenv("CA_CERT", "./ca.crt")
-OUTPUT_DIR = os.getenv("OUTPUT_DIR", "./certs")
-ORGANIZATION = os.getenv("ORGANIZATION", "DefaultOrganization")
-COUNTRY = os.getenv("COUNTRY", "US")
-CERT_VALIDITY_DAYS = int(os.getenv("CERT_VALIDITY_DAYS", "365"))  # Default to 365 days if not specified
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """
+    Certificate settings read from the environment.
+    """
+
+    ca_key: str
+    ca_cert: str
+    output_dir: str
+    organization: str
+    country: str
+    cert_validity_days: int
+    key_algo: str
+    renew_before_days: int
+
+
+def load_config():
+    """
+    Read the configuration from the .env file and environment variables.
+    """
+    # Load environment variables from .env file
+    load_dotenv()
+
+    return Config(
+        ca_key=os.getenv("CA_KEY", "./ca.key"),
+        ca_cert=os.getenv("CA_CERT", "./ca.crt"),
+        output_dir=os.getenv("OUTPUT_DIR", "./certs"),
+        organization=os.getenv("ORGANIZATION", "DefaultOrganization"),
+        country=os.getenv("COUNTRY", "US"),
+        cert_validity_days=int(os.getenv("CERT_VALIDITY_DAYS", "365")),  # Default to 365 days if not specified
+        key_algo=os.getenv("KEY_ALGO", "rsa2048"),  # rsa2048 or ec256
+        renew_before_days=int(os.getenv("RENEW_BEFORE_DAYS", "30")),
+    )
+
+
+CONFIG = load_config()
+
+
+@functools.lru_cache(maxsize=None)
+def load_ca_key(ca_key_password=None, config=CONFIG):
+    """
+    Load and decrypt the CA private key, once per password. A password given for an
+    unencrypted key is ignored, as openssl does with -passin.
+    """
+    with open(config.ca_key, "rb") as f:
+        key_data = f.read()
+    if ca_key_password:
+        try:
+            return serialization.load_pem_private_key(key_data, password=ca_key_password.encode())
+        except TypeError:
+            # Raised when the key is not encrypted; retry without the password below
+            pass
+    return serialization.load_pem_private_key(key_data, password=None)
+
+
+@functools.lru_cache(maxsize=None)
+def load_ca_cert(config=CONFIG):
+    """
+    Load the CA certificate, once.
+    """
+    with open(config.ca_cert, "rb") as f:
+        return x509.load_pem_x509_certificate(f.read())
+
+
+def load_ca(ca_key_password=None, config=CONFIG):
+    """
+    Load the CA private key and certificate into memory.
+    """
+    return load_ca_key(ca_key_password, config), load_ca_cert(config)
+
+
+def generate_private_key(config=CONFIG):
+    """
+    Generate a private key for a new certificate using the configured KEY_ALGO.
+    """
+    if config.key_algo == "rsa2048":
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    if config.key_algo == "ec256":
+        return ec.generate_private_key(ec.SECP256R1())
+    raise ValueError(f"Unsupported KEY_ALGO: {config.key_algo} (expected rsa2048 or ec256)")
+
+
+def read_san_file(san_file):
+    """
+    Read the DNS names stored in a SAN configuration file.
+    """
+    with open(san_file) as f:
+        return re.findall(r"^DNS\.\d+\s*=\s*(\S+)\s*$", f.read(), re.MULTILINE)
 
 
-def generate_certificate_from_csr(csr_file, cert_file, san_file, ca_key_password=None):
+def sign_certificate(csr, dns_names, ca_key, ca_cert, config=CONFIG):
     """
-    Generate a certificate from an existing CSR file while reusing SANs stored in a file.
+    Sign a CSR with the CA key, applying the v3_req extensions and the given SANs.
     """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    # Key encipherment only applies to RSA keys; ECDSA keys only sign
+    rsa_key = isinstance(csr.public_key(), rsa.RSAPublicKey)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(csr.subject)
+        .issuer_name(ca_cert.subject)
+        .public_key(csr.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=config.cert_validity_days))
+        .add_extension(
+            x509.KeyUsage(
+                digital_signature=True,
+                content_commitment=False,
+                key_encipherment=rsa_key,
+                data_encipherment=False,
+                key_agreement=False,
+                key_cert_sign=False,
+                crl_sign=False,
+                encipher_only=False,
+                decipher_only=False,
+            ),
+            critical=True,
+        )
+        .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH]), critical=False)
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(n) for n in dns_names]), critical=False)
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(csr.public_key()), critical=False)
+        .add_extension(
+            x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()), critical=False
+        )
+    )
+    return builder.sign(ca_key, hashes.SHA256())
+
+
+def write_file_atomic(path, data, mode=0o644):
+    """
+    Write bytes to a file by renaming a private temporary file over it, so readers never
+    see a partially written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
     try:
-        print(f"Renewing certificate for CSR: {csr_file}")
+        # Write the encoded bytes straight to the descriptor, looping on short writes
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 
-        if not os.path.exists(san_file):
+def write_certificate(cert, cert_file):
+    """
+    Write a certificate to disk in PEM format.
+    """
+    write_file_atomic(cert_file, cert.public_bytes(serialization.Encoding.PEM))
+
+
+def read_csr_sans(csr):
+    """
+    Return the DNS names requested in a CSR, or None if it carries no SAN extension.
+    """
+    try:
+        ext = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+    except x509.ExtensionNotFound:
+        return None
+    return ext.value.get_values_for_type(x509.DNSName)
+
+
+def generate_certificate_from_csr(csr_file, cert_file, san_file, ca_key, ca_cert, config=CONFIG):
+    """
+    Generate a certificate from an existing CSR file, reusing the SANs stored in the SAN file
+    or, if there is none, the SANs embedded in the CSR.
+    """
+    try:
+        log.debug("Renewing certificate for CSR: %s", csr_file)
+
+        with open(csr_file, "rb") as f:
+            csr = x509.load_pem_x509_csr(f.read())
+
+        # The SAN file is operator-controlled, so it wins over what the CSR requests
+        csr_sans = read_csr_sans(csr)
+        if os.path.exists(san_file):
+            dns_names = read_san_file(san_file)
+            if csr_sans is not None and set(csr_sans) != set(dns_names):
+                log.warning("SANs in %s differ from the CSR; using the SAN file", san_file)
+        elif csr_sans is not None:
+            dns_names = csr_sans
+        else:
             raise FileNotFoundError(f"SAN configuration file not found: {san_file}")
 
-        # Sign the certificate using the stored SAN configuration
-        sign_command = [
-            "openssl",
-            "x509",
-            "-req",
-            "-in",
-            csr_file,
-            "-CA",
-            CA_CERT,
-            "-CAkey",
-            CA_KEY,
-            "-CAcreateserial",
-            "-out",
-            cert_file,
-            "-days",
-            str(CERT_VALIDITY_DAYS),
-            "-sha256",
-            "-extensions",
-            "v3_req",
-            "-extfile",
-            san_file,
-        ]
-
-        if ca_key_password:
-            sign_command.extend(["-passin", f"pass:{ca_key_password}"])
-
-        subprocess.run(sign_command, check=True)
-
-        print(f"Certificate successfully renewed: {cert_file}")
-
-    except subprocess.CalledProcessError as e:
-        print(f"An error occurred during the certificate renewal process: {e}")
+        cert = sign_certificate(csr, dns_names, ca_key, ca_cert, config)
+        write_certificate(cert, cert_file)
+
+        log.debug("Certificate successfully renewed: %s", cert_file)
+
+    except (OSError, TypeError, ValueError) as e:
+        log.error("An error occurred during the certificate renewal process: %s", e)
         raise
 
 
-def generate_san_file(common_name, sans):
-    """
-    Save the SAN configuration to the output directory in a file.
+_SAN_TEMPLATE = string.Template(
     """
-    san_file_path = os.path.join(OUTPUT_DIR, f"{common_name}.san")
-    config_content = f"""
 [ req ]
 default_bits        = 2048
 prompt              = no
@@ -75,9 +230,9 @@ req_extensions      = v3_req
 x509_extensions     = v3_req
 
 [ req_distinguished_name ]
-C  = {COUNTRY}
-O  = {ORGANIZATION}
-CN = {common_name}
+C  = $country
+O  = $org
+CN = $cn
 
 [ v3_req ]
 keyUsage = critical, digitalSignature, keyEncipherment
@@ -85,135 +240,190 @@ extendedKeyUsage = serverAuth
 subjectAltName = @alt_names
 
 [ alt_names ]
-DNS.1 = {common_name}
-"""
+DNS.1 = $cn
+$extra"""
+)
 
-    # Add SANs to the configuration
-    if sans:
-        for idx, san in enumerate(sans, start=2):
-            config_content += f"DNS.{idx} = {san}\n"
 
-    # Save SAN configuration to file
-    with open(san_file_path, "w") as f:
-        f.write(config_content)
+def generate_san_file(common_name, sans, config=CONFIG):
+    """
+    Save the SAN configuration to the output directory in a file.
+    """
+    san_file_path = os.path.join(config.output_dir, f"{common_name}.san")
+    san_lines = "".join(f"DNS.{idx} = {san}\n" for idx, san in enumerate(sans or [], start=2))
+    config_content = _SAN_TEMPLATE.substitute(
+        country=config.country, org=config.organization, cn=common_name, extra=san_lines
+    )
 
-    print(f"SAN file created: {san_file_path}")
+    # Save SAN configuration to file; renewal reads it back, so write it atomically too
+    write_file_atomic(san_file_path, config_content.encode("utf-8"))
+
+    log.debug("SAN file created: %s", san_file_path)
     return san_file_path
 
 
-def renew_all_csrs(output_dir, ca_key_password):
+# Configuration and CA loaded once in each renewal worker process; with
+# the fork start method this reuses the parent's cached load_ca results
+_worker_config = None
+_worker_ca = None
+
+
+def _init_renew_worker(ca_key_password, config):
     """
-    Renew all CSRs in the output directory using stored SAN files.
+    Load the configuration and CA into a renewal worker process.
     """
-    print("Looking for CSRs to renew...")
+    global _worker_config, _worker_ca
+    _worker_config = config
+    _worker_ca = load_ca(ca_key_password, config)
 
-    for file_name in os.listdir(output_dir):
-        if file_name.endswith(".csr"):
-            csr_file = os.path.join(output_dir, file_name)
-            cert_file = os.path.join(output_dir, file_name.replace(".csr", ".crt"))
-            common_name = os.path.splitext(file_name)[0]
-            san_file = os.path.join(output_dir, f"{common_name}.san")
 
-            # Renew certificate using the CSR and the corresponding SAN file
-            generate_certificate_from_csr(csr_file, cert_file, san_file, ca_key_password)
-
-    print("All CSRs have been renewed!")
+def _renew_batch(jobs):
+    """
+    Renew a batch of certificates inside a renewal worker process.
+    """
+    for csr_file, cert_file, san_file in jobs:
+        generate_certificate_from_csr(csr_file, cert_file, san_file, *_worker_ca, _worker_config)
 
 
-def generate_certificate(common_name, sans=None, ca_key_password=None):
+def needs_renewal(csr_entry, cert_file, san_file, config=CONFIG):
+    """
+    Check whether the certificate for a CSR is missing, older than the CSR or its SAN file,
+    or due to expire within the renewal window.
+    """
+    try:
+        cert_mtime = os.stat(cert_file).st_mtime
+        if cert_mtime < csr_entry.stat().st_mtime:
+            return True
+        if os.path.exists(san_file) and cert_mtime < os.stat(san_file).st_mtime:
+            return True
+        with open(cert_file, "rb") as f:
+            cert = x509.load_pem_x509_certificate(f.read())
+    except (OSError, ValueError):
+        return True
+
+    # not_valid_after_utc only exists in cryptography 42 and later
+    not_after = getattr(cert, "not_valid_after_utc", None)
+    if not_after is None:
+        not_after = cert.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+    remaining = not_after - datetime.datetime.now(datetime.timezone.utc)
+    return remaining <= datetime.timedelta(days=config.renew_before_days)
+
+
+def renew_all_csrs(output_dir, ca_key_password, force=False, config=CONFIG):
+    """
+    Renew the certificates in the output directory that are due, using their stored SAN files
+    or the SANs their CSRs carry. With force, renew every CSR.
+    """
+    log.debug("Looking for CSRs to renew...")
+    start = time.perf_counter()
+
+    jobs = []
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".csr"):
+                base = entry.path.removesuffix(".csr")
+                if force or needs_renewal(entry, f"{base}.crt", f"{base}.san", config):
+                    jobs.append((entry.path, f"{base}.crt", f"{base}.san"))
+                else:
+                    log.debug("Certificate still valid, skipping: %s.crt", base)
+
+    # Nothing is due, so there is no reason to touch the CA
+    if not jobs:
+        log.info("Renewed 0 certificates in %.2fs", time.perf_counter() - start)
+        return
+
+    # Only start as many workers as there are certificates to renew; each
+    # worker process has a startup cost that a single job cannot amortize
+    workers = min(os.cpu_count() or 1, len(jobs))
+    if workers == 1:
+        for csr_file, cert_file, san_file in jobs:
+            generate_certificate_from_csr(csr_file, cert_file, san_file, *load_ca(ca_key_password, config), config)
+    else:
+        # Fail fast on a wrong CA password before starting any workers
+        load_ca(ca_key_password, config)
+
+        # Split the jobs into one batch per worker so each task amortizes its
+        # dispatch over many signatures
+        batches = [jobs[i::workers] for i in range(workers)]
+
+        # Renew certificates in parallel; each worker loads the CA once and
+        # mints its own random serial numbers, so no state is shared
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_renew_worker, initargs=(ca_key_password, config)
+        ) as executor:
+            # Collect results as they finish rather than in submission order,
+            # so a slow batch does not hold up reporting a failed one
+            futures = [executor.submit(_renew_batch, batch) for batch in batches]
+            for future in as_completed(futures):
+                future.result()
+
+    log.info("Renewed %d certificates in %.2fs", len(jobs), time.perf_counter() - start)
+
+
+def generate_certificate(common_name, sans=None, ca_key_password=None, config=CONFIG):
     """
     Generate a new private key, CSR, certificate, and save the SAN config to a file.
     """
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
+    # exist_ok makes this a single call that is safe against concurrent creation
+    os.makedirs(config.output_dir, exist_ok=True)
 
     # File paths
-    key_file = os.path.join(OUTPUT_DIR, f"{common_name}.key")
-    csr_file = os.path.join(OUTPUT_DIR, f"{common_name}.csr")
-    cert_file = os.path.join(OUTPUT_DIR, f"{common_name}.crt")
+    key_file = os.path.join(config.output_dir, f"{common_name}.key")
+    csr_file = os.path.join(config.output_dir, f"{common_name}.csr")
+    cert_file = os.path.join(config.output_dir, f"{common_name}.crt")
 
     try:
+        # Generate SAN file
+        san_file = generate_san_file(common_name, sans or [], config)
+
         # Generate private key
-        print(f"Generating private key: {key_file}")
-        subprocess.run(["openssl", "genrsa", "-out", key_file, "2048"], check=True)
+        log.debug("Generating private key: %s", key_file)
+        key = generate_private_key(config)
+        write_file_atomic(
+            key_file,
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            ),
+            mode=0o600,
+        )
+
+        subject = x509.Name(
+            [
+                x509.NameAttribute(NameOID.COUNTRY_NAME, config.country),
+                x509.NameAttribute(NameOID.ORGANIZATION_NAME, config.organization),
+                x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+            ]
+        )
+        csr_builder = x509.CertificateSigningRequestBuilder().subject_name(subject)
 
         # Generate CSR with SANs if provided
         if sans:
-            print(f"Generating CSR with SANs: {csr_file}")
-            san_file = generate_san_file(common_name, sans)
-
-            # Generate CSR using the SAN configuration
-            subprocess.run(
-                [
-                    "openssl",
-                    "req",
-                    "-new",
-                    "-key",
-                    key_file,
-                    "-out",
-                    csr_file,
-                    "-config",
-                    san_file,
-                ],
-                check=True,
+            log.debug("Generating CSR with SANs: %s", csr_file)
+            csr_builder = csr_builder.add_extension(
+                x509.SubjectAlternativeName([x509.DNSName(n) for n in [common_name] + sans]), critical=False
             )
         else:
-            print(f"Generating CSR without SANs: {csr_file}")
-            subprocess.run(
-                [
-                    "openssl",
-                    "req",
-                    "-new",
-                    "-key",
-                    key_file,
-                    "-out",
-                    csr_file,
-                    "-subj",
-                    f"/C={COUNTRY}/O={ORGANIZATION}/CN={common_name}",
-                ],
-                check=True,
-            )
+            log.debug("Generating CSR without SANs: %s", csr_file)
 
-        # Generate SAN file
-        san_file = generate_san_file(common_name, sans or [])
+        csr = csr_builder.sign(key, hashes.SHA256())
+        write_file_atomic(csr_file, csr.public_bytes(serialization.Encoding.PEM))
 
         # Sign the CSR to create the certificate
-        print(f"Signing certificate: {cert_file}")
-        sign_command = [
-            "openssl",
-            "x509",
-            "-req",
-            "-in",
-            csr_file,
-            "-CA",
-            CA_CERT,
-            "-CAkey",
-            CA_KEY,
-            "-CAcreateserial",
-            "-out",
-            cert_file,
-            "-days",
-            str(CERT_VALIDITY_DAYS),
-            "-sha256",
-            "-extensions",
-            "v3_req",
-            "-extfile",
-            san_file,
-        ]
-
-        if ca_key_password:
-            sign_command.extend(["-passin", f"pass:{ca_key_password}"])
-
-        subprocess.run(sign_command, check=True)
-
-        print("Certificate successfully created!")
-        print(f"  Private Key File: {key_file}")
-        print(f"  CSR File        : {csr_file}")
-        print(f"  Certificate File: {cert_file}")
-        print(f"  SAN File        : {san_file}")
-
-    except subprocess.CalledProcessError as e:
-        print(f"An error occurred during the OpenSSL process: {e}")
+        log.debug("Signing certificate: %s", cert_file)
+        ca_key, ca_cert = load_ca(ca_key_password, config)
+        cert = sign_certificate(csr, [common_name] + (sans or []), ca_key, ca_cert, config)
+        write_certificate(cert, cert_file)
+
+        log.info("Certificate successfully created!")
+        log.info("  Private Key File: %s", key_file)
+        log.info("  CSR File        : %s", csr_file)
+        log.info("  Certificate File: %s", cert_file)
+        log.info("  SAN File        : %s", san_file)
+
+    except (OSError, TypeError, ValueError) as e:
+        log.error("An error occurred while generating the certificate: %s", e)
         raise
 
 
@@ -228,18 +438,28 @@ if __name__ == "__main__":
     )
     parser.add_argument("-pw", "--password", help="Password for the CA private key", required=False)
     parser.add_argument(
-        "-r", "--renew", action="store_true", help="Renew all CSRs in the output directory", required=False
+        "-r",
+        "--renew",
+        action="store_true",
+        help="Renew due certificates for the CSRs in the output directory",
+        required=False,
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="Renew all certificates, even those not yet due", required=False
     )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show per-certificate progress", required=False)
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(message)s")
+    log.debug("Crypto backend: %s", openssl_backend.openssl_version_text())
 
     # Handle password input
     ca_key_password = args.password or getpass("Enter password for CA private key (if any): ")
 
     try:
         if args.renew:
-            # Renew all CSRs in the output directory
-            renew_all_csrs(OUTPUT_DIR, ca_key_password)
+            # Renew due certificates in the output directory
+            renew_all_csrs(CONFIG.output_dir, ca_key_password, force=args.force)
         else:
             # Create a new certificate
             common_name = args.common_name or input("Enter Common Name (e.g., example.com): ").strip()
@@ -249,4 +469,4 @@ if __name__ == "__main__":
             sans_list = [san.strip() for san in sans_input.split(",")] if sans_input else None
             generate_certificate(common_name, sans_list, ca_key_password)
     except Exception as e:
-        print(f"An error occurred: {e}")
+        log.error("An error occurred: %s", e)